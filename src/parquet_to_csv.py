@@ -1,16 +1,55 @@
 
-# Requirements: pip install pandas pyarrow
+# Requirements: pip install pyarrow
+# Optional: pip install polars (for --engine polars)
 # Usage: python parquet_to_csv.py input.parquet output.csv
 
-import pandas as pd
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import argparse
+import queue
+import sys
+import threading
 
-def parquet_to_csv(input_file, output_file):
-    # Read the Parquet file
-    df = pd.read_parquet(input_file)
-    
-    # Write the DataFrame to a CSV file
-    df.to_csv(output_file, index=False)
+def parquet_to_csv_polars(input_file, output_file):
+    # Polars' Rust reader/writer is faster for bulk conversion;
+    # sink_csv streams the result without materializing the frame
+    try:
+        import polars as pl
+    except ImportError:
+        print("Error: --engine polars requires the 'polars' package "
+              "(pip install polars)", file=sys.stderr)
+        sys.exit(1)
+    pl.scan_parquet(input_file).sink_csv(output_file)
+    print(f"Conversion complete. CSV file saved as {output_file}")
+
+def parquet_to_csv(input_file, output_file, batch_size=65536):
+    # Open the Parquet file without materializing it
+    pf = pq.ParquetFile(input_file)
+
+    # Read batches in a producer thread and write CSV in the main thread,
+    # so Parquet read+decompress overlaps CSV encode+write. The bounded
+    # queue keeps at most two batches in flight, so peak memory stays
+    # bounded by the batch size instead of the full file size
+    batches = queue.Queue(maxsize=2)
+    read_error = []
+
+    def read_batches():
+        try:
+            for batch in pf.iter_batches(batch_size=batch_size, use_threads=True):
+                batches.put(batch)
+        except BaseException as e:
+            read_error.append(e)
+        finally:
+            batches.put(None)  # sentinel: no more batches
+
+    reader = threading.Thread(target=read_batches, daemon=True)
+    reader.start()
+    with pacsv.CSVWriter(output_file, pf.schema_arrow) as writer:
+        while (batch := batches.get()) is not None:
+            writer.write_batch(batch)
+    reader.join()
+    if read_error:
+        raise read_error[0]
     print(f"Conversion complete. CSV file saved as {output_file}")
 
 if __name__ == "__main__":
@@ -18,8 +57,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert Parquet file to CSV")
     parser.add_argument("input", help="Input Parquet file path")
     parser.add_argument("output", help="Output CSV file path")
+    parser.add_argument("--batch-size", type=int, default=65536,
+                        help="Number of rows per streamed batch (default: 65536)")
+    parser.add_argument("--engine", choices=["pyarrow", "polars"], default="pyarrow",
+                        help="Conversion engine (default: pyarrow)")
     args = parser.parse_args()
 
     # Call the conversion function
-    parquet_to_csv(args.input, args.output)
-
+    if args.engine == "polars":
+        parquet_to_csv_polars(args.input, args.output)
+    else:
+        parquet_to_csv(args.input, args.output, args.batch_size)